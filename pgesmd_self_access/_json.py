@@ -0,0 +1,16 @@
+"""JSON backend for pgesmd, orjson when available, stdlib json otherwise."""
+
+try:
+    import orjson
+
+    loads = orjson.loads
+
+    def dumps(obj):
+        """Serialize obj to a JSON str."""
+        return orjson.dumps(obj).decode("utf-8")
+
+except ImportError:
+    import json
+
+    loads = json.loads
+    dumps = json.dumps
@@ -1,15 +1,27 @@
 """Classes and methods to work with the PG&E Share My Data API."""
 
+import asyncio
+import httpx
 import requests
-import json
 import os
+import ssl
 import xml.etree.ElementTree as ET
 import logging
+import threading
 import time
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from datetime import datetime
-from pytz import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from ._json import dumps, loads
 from .helpers import get_auth_file
 
 logging.basicConfig(
@@ -18,6 +30,9 @@ logging.basicConfig(
 )
 _LOGGER = logging.getLogger(__name__)
 
+_TZ = ZoneInfo("America/Los_Angeles")
+_PRINT_LOCK = threading.Lock()
+
 
 class SelfAccessApi:
     """Representation of the PG&E SMD API for Self Access Users.
@@ -33,9 +48,31 @@ class SelfAccessApi:
         token_uri: string,
         utility_uri: string,
         api_uri: string,
-        service_status_uri: string
+        service_status_uri: string,
+        token_cache_path: string (default ./auth/token_cache.json)
     """
 
+    __slots__ = (
+        "third_party_id",
+        "client_id",
+        "client_secret",
+        "cert",
+        "_access_token",
+        "_bearer_header",
+        "access_token_exp",
+        "token_uri",
+        "utility_uri",
+        "api_uri",
+        "service_status_uri",
+        "bulk_resource_uri",
+        "auth_header",
+        "token_cache_path",
+        "_session",
+        "_aclient",
+        "_aclient_loop",
+        "_token_lock",
+    )
+
     def __init__(
         self,
         third_party_id,
@@ -47,6 +84,7 @@ class SelfAccessApi:
         utility_uri=None,
         api_uri=None,
         service_status_uri=None,
+        token_cache_path=f"{os.getcwd()}/auth/token_cache.json",
     ):
         """Initialize the API."""
         self.third_party_id = third_party_id
@@ -88,61 +126,203 @@ class SelfAccessApi:
         b64 = b64encode(f"{self.client_id}:{self.client_secret}".encode("utf-8"))
         self.auth_header = f"Basic {bytes.decode(b64)}"
 
+        self._session = requests.Session()
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET", "POST"),
+            raise_on_status=False,
+        )
+        self._session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry),
+        )
+        self._session.cert = self.cert
+        self._aclient = None
+        self._aclient_loop = None
+
+        self._token_lock = threading.RLock()
+        self.token_cache_path = token_cache_path
+        self.load_token_cache()
+
+    @property
+    def access_token(self):
+        """The current access token."""
+        return self._access_token
+
+    @access_token.setter
+    def access_token(self, access_token):
+        """Set the access token and rebuild the Bearer header sent with it."""
+        self._access_token = access_token
+        self._bearer_header = {"Authorization": f"Bearer {access_token}"}
+
+    def close(self):
+        """Close the HTTP session and HTTP/2 client, release pooled connections."""
+        self._session.close()
+        self._discard_async_client()
+
+    def _discard_async_client(self):
+        """Close the HTTP/2 client on the event loop it was created on."""
+        aclient, loop = self._aclient, self._aclient_loop
+        self._aclient = None
+        self._aclient_loop = None
+        if aclient is None:
+            return
+
+        if loop.is_running():
+            # Closes once control returns to the loop, which may be this one
+            asyncio.run_coroutine_threadsafe(aclient.aclose(), loop)
+            return
+        if not loop.is_closed():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                loop.run_until_complete(aclient.aclose())
+                return
+        _LOGGER.warning(
+            "Could not close the HTTP/2 client, await aclose() before its event "
+            "loop is closed."
+        )
+
+    def _async_client(self):
+        """Return the HTTP/2 client used by the coroutine methods.
+
+        The client is bound to the event loop it was created on, so a client
+        left over from another loop is closed and a new one created.
+        """
+        loop = asyncio.get_running_loop()
+        if self._aclient is not None and self._aclient_loop is not loop:
+            self._discard_async_client()
+        if self._aclient is None:
+            context = ssl.create_default_context()
+            context.load_cert_chain(*self.cert)
+            self._aclient = httpx.AsyncClient(http2=True, verify=context, timeout=30.0)
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def aclose(self):
+        """Close the HTTP/2 client used by the coroutine methods."""
+        if self._aclient is not None:
+            aclient = self._aclient
+            self._aclient = None
+            self._aclient_loop = None
+            await aclient.aclose()
+
     def need_token(self):
         """Return True if the access token has expired, False otherwise."""
         if time.time() > self.access_token_exp - 5:
             return True
         return False
 
+    def load_token_cache(self):
+        """Restore an unexpired access token saved by a previous instance."""
+        if not self.token_cache_path:
+            return
+        try:
+            with open(self.token_cache_path, "rb") as cache:
+                content = loads(cache.read())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            _LOGGER.warning(f"Could not read token cache at {self.token_cache_path}")
+            return
+        try:
+            if (
+                content["client_id"] != self.client_id
+                or content["token_uri"] != self.token_uri
+            ):
+                return
+            self.access_token = content["access_token"]
+            self.access_token_exp = float(content["access_token_exp"])
+        except (KeyError, TypeError, ValueError):
+            _LOGGER.warning(f"Ignoring malformed token cache {self.token_cache_path}")
+
+    def save_token_cache(self):
+        """Persist the access token so it survives a process restart."""
+        if not self.token_cache_path:
+            return
+        content = {
+            "client_id": self.client_id,
+            "token_uri": self.token_uri,
+            "access_token": self.access_token,
+            "access_token_exp": self.access_token_exp,
+        }
+        try:
+            fd = os.open(
+                self.token_cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(fd, "w") as cache:
+                cache.write(dumps(content))
+        except OSError:
+            _LOGGER.warning(f"Could not write token cache at {self.token_cache_path}")
+
+    def refresh_token(self):
+        """Get a new access token only if the current one has expired."""
+        with self._token_lock:
+            if self.need_token():
+                self.get_token()
+
+    async def arefresh_token(self):
+        """Coroutine version of refresh_token, requests the token off the loop."""
+        if self.need_token():
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.refresh_token)
+
     def get_token(self):
         """Request and return access token from the PGE SMD Servers."""
-        if not self.auth_header:
-            _LOGGER.critical("Missing self.auth_header, RI violated.")
+        with self._token_lock:
+            if not self.auth_header:
+                _LOGGER.critical("Missing self.auth_header, RI violated.")
 
-        if not self.cert[0] or not self.cert[1]:
-            _LOGGER.critical("Missing self.cert, RI violated.")
+            if not self.cert[0] or not self.cert[1]:
+                _LOGGER.critical("Missing self.cert, RI violated.")
 
-        request_params = {"grant_type": "client_credentials"}
-        header_params = {"Authorization": self.auth_header}
+            request_params = {"grant_type": "client_credentials"}
+            header_params = {"Authorization": self.auth_header}
 
-        response = requests.post(
-            self.token_uri, data=request_params, headers=header_params, cert=self.cert
-        )
+            response = self._session.post(
+                self.token_uri, data=request_params, headers=header_params
+            )
 
-        if str(response.status_code) == "200":
-            try:
-                content = json.loads(response.text)
-                self.access_token = content["client_access_token"]
-                self.access_token_exp = time.time() + int(content["expires_in"])
-                return self.access_token
-            except KeyError:
-                _LOGGER.error(
-                    "get_token failed.  Server JSON response"
-                    'did not contain "client_access_token" key'
-                )
-                return None
+            if response.status_code == 200:
+                try:
+                    content = loads(response.content)
+                    self.access_token = content["client_access_token"]
+                    self.access_token_exp = time.time() + int(content["expires_in"])
+                    self.save_token_cache()
+                    return self.access_token
+                except KeyError:
+                    _LOGGER.error(
+                        "get_token failed.  Server JSON response"
+                        'did not contain "client_access_token" key'
+                    )
+                    return None
+                except ValueError:
+                    _LOGGER.error(
+                        f"get_token failed.  Could not parse the "
+                        f"{len(response.content)} byte server JSON response."
+                    )
+                    return None
 
-        _LOGGER.error(
-            f"get_token failed.  |  " f"{response.status_code}: {response.text}"
-        )
-        return None
+            _LOGGER.error(
+                f"get_token failed.  |  " f"{response.status_code}: {response.text}"
+            )
+            return None
 
     def request_latest_data(self):
         """Return True upon successful asynchronous request."""
-        if self.need_token():
-            self.get_token()
-
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
+        self.refresh_token()
 
         _LOGGER.debug(
             f"Sending request to {self.bulk_resource_uri} using"
             f"access_token {self.access_token}"
         )
 
-        response = requests.get(
-            self.bulk_resource_uri, data={}, headers=header_params, cert=self.cert
+        response = self._session.get(
+            self.bulk_resource_uri, data={}, headers=self._bearer_header
         )
-        if str(response.status_code) == "202":
+        if response.status_code == 202:
             _LOGGER.info("request successful," " awaiting POST from server.")
             return True
         _LOGGER.error(
@@ -153,15 +333,12 @@ class SelfAccessApi:
 
     def request_sequential_data(self, start, end_date=None):
         """Return True upon successful asynchronous request."""
-        if self.need_token():
-            self.get_token()
+        self.refresh_token()
 
         if not end_date:
             end_date = int(time.time())
         start_date = start
 
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
-
         params = {"published-min": start_date, "published-max": end_date}
 
         _LOGGER.debug(
@@ -169,14 +346,10 @@ class SelfAccessApi:
             f"access_token {self.access_token}"
         )
 
-        response = requests.get(
-            self.bulk_resource_uri,
-            data={},
-            headers=header_params,
-            params=params,
-            cert=self.cert,
+        response = self._session.get(
+            self.bulk_resource_uri, data={}, headers=self._bearer_header, params=params
         )
-        if str(response.status_code) == "202":
+        if response.status_code == 202:
             _LOGGER.info("request successful," " awaiting POST from server.")
             return True
         _LOGGER.error(
@@ -185,24 +358,62 @@ class SelfAccessApi:
         )
         return False
 
+    @staticmethod
+    def get_date_range(date):
+        """Return the (start, end) epoch seconds of a date in Pacific time.
+
+        Arguments:
+            date -- date string in format %Y-%m-%d
+        """
+        dt = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=_TZ)
+
+        start_date = int(dt.timestamp())
+        end_date = start_date + 82800
+        return (start_date, end_date)
+
     def request_date_data(self, date):
         """Return True upon successful asynchronous request.
 
         Arguments:
             date -- date string in format %Y-%m-%d
         """
-        if self.need_token():
-            self.get_token()
+        self.refresh_token()
 
-        tz = timezone("US/Pacific")
-        dt = datetime.strptime(date, "%Y-%m-%d")
-        offset = tz.utcoffset(dt).total_seconds()
-        epoch = (dt - datetime(1970, 1, 1)).total_seconds()
+        start_date, end_date = self.get_date_range(date)
 
-        start_date = int(epoch - offset)
-        end_date = start_date + 82800
+        params = {"published-min": start_date, "published-max": end_date}
 
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
+        _LOGGER.debug(
+            f"Sending request to {self.bulk_resource_uri} using"
+            f"access_token {self.access_token}"
+        )
+
+        response = self._session.get(
+            self.bulk_resource_uri, data={}, headers=self._bearer_header, params=params
+        )
+        if response.status_code == 202:
+            _LOGGER.info("request successful," " awaiting POST from server.")
+            return True
+        _LOGGER.error(
+            f"request to Bulk Resource URI failed.  |  "
+            f"{response.status_code}: {response.text}"
+        )
+        return False
+
+    async def arequest_date_data(self, date, retries=5):
+        """Return True upon successful asynchronous request.
+
+        Coroutine version of request_date_data that shares one HTTP/2
+        connection, for use with asyncio.gather over many dates.
+
+        Arguments:
+            date -- date string in format %Y-%m-%d
+            retries -- Optional; retries with exponential backoff when the
+                server responds 429 Too Many Requests (Default: 5)
+        """
+        await self.arefresh_token()
+
+        start_date, end_date = self.get_date_range(date)
 
         params = {"published-min": start_date, "published-max": end_date}
 
@@ -211,14 +422,17 @@ class SelfAccessApi:
             f"access_token {self.access_token}"
         )
 
-        response = requests.get(
-            self.bulk_resource_uri,
-            data={},
-            headers=header_params,
-            params=params,
-            cert=self.cert,
-        )
-        if str(response.status_code) == "202":
+        for attempt in range(retries + 1):
+            response = await self._async_client().get(
+                self.bulk_resource_uri, headers=self._bearer_header, params=params
+            )
+            if response.status_code != 429 or attempt == retries:
+                break
+            delay = 0.5 * 2**attempt
+            _LOGGER.warning(f"Rate limited for {date}, retrying in {delay} seconds.")
+            await asyncio.sleep(delay)
+
+        if response.status_code == 202:
             _LOGGER.info("request successful," " awaiting POST from server.")
             return True
         _LOGGER.error(
@@ -227,6 +441,41 @@ class SelfAccessApi:
         )
         return False
 
+    async def arequest_date_range(self, dates, max_concurrent=8):
+        """Return a list of arequest_date_data results, one for each date.
+
+        Arguments:
+            dates -- iterable of date strings in format %Y-%m-%d
+            max_concurrent -- Optional; requests in flight at once (Default: 8)
+        """
+        await self.arefresh_token()
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def request(date):
+            async with semaphore:
+                return await self.arequest_date_data(date)
+
+        return await asyncio.gather(*(request(date) for date in dates))
+
+    def request_date_range(self, dates, max_concurrent=8):
+        """Return a list of request results, one for each date.
+
+        Blocking wrapper around arequest_date_range, do not call from a running
+        event loop.
+
+        Arguments:
+            dates -- iterable of date strings in format %Y-%m-%d
+            max_concurrent -- Optional; requests in flight at once (Default: 8)
+        """
+
+        async def request_all():
+            try:
+                return await self.arequest_date_range(dates, max_concurrent)
+            finally:
+                await self.aclose()
+
+        return asyncio.run(request_all())
+
     def request_historical_data(self, days=730, end_date=None):
         """Get the historical usage data.
 
@@ -234,8 +483,7 @@ class SelfAccessApi:
             days -- Optional; integer, how many days back (Default: 730)
             end_date -- Optional; date string to stop at (Default: today)
         """
-        if self.need_token():
-            self.get_token()
+        self.refresh_token()
 
         seconds_in_one_day = 86400
 
@@ -243,8 +491,6 @@ class SelfAccessApi:
             end_date = int(time.time())
         start_date = end_date - seconds_in_one_day * days
 
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
-
         params = {"published-min": start_date, "published-max": end_date}
 
         _LOGGER.debug(
@@ -252,14 +498,10 @@ class SelfAccessApi:
             f"access_token {self.access_token}"
         )
 
-        response = requests.get(
-            self.bulk_resource_uri,
-            data={},
-            headers=header_params,
-            params=params,
-            cert=self.cert,
+        response = self._session.get(
+            self.bulk_resource_uri, data={}, headers=self._bearer_header, params=params
         )
-        if str(response.status_code) == "202":
+        if response.status_code == 202:
             _LOGGER.info("request successful," " awaiting POST from server.")
             return True
         _LOGGER.error(
@@ -269,31 +511,27 @@ class SelfAccessApi:
         return False
 
     def get_espi_data(self, resource_uri, _retried=False):
-        """Get the ESPI data from the API.
+        """Get the ESPI data from the API as bytes.
 
         Arguments:
             resource_uri -- string, the URI parsed from a PGE notification
         """
-        if self.need_token():
-            self.get_token()
-
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
+        self.refresh_token()
 
-        response = requests.get(
-            resource_uri, data={}, headers=header_params, cert=self.cert
-        )
-        if str(response.status_code) == "200":
-            xml_data = response.text
+        response = self._session.get(resource_uri, data={}, headers=self._bearer_header)
+        if response.status_code == 200:
+            xml_data = response.content
             return xml_data
-        elif str(response.status_code) == "403" and not _retried:
+        elif response.status_code == 403 and not _retried:
             _LOGGER.error(
                 f"get_espi_data failed. Refreshing token."
                 f"{resource_uri} responded: "
                 f"{response.status_code}: {response.text}"
             )
             if self.get_token():
-                self.get_espi_data(resource_uri, _retried=True)
-        elif str(response.status_code) == "403":
+                return self.get_espi_data(resource_uri, _retried=True)
+            return None
+        elif response.status_code == 403:
             _LOGGER.error(
                 f"get_espi_data failed. Check auth file."
                 f"{resource_uri} responded: "
@@ -307,22 +545,20 @@ class SelfAccessApi:
 
     def get_service_status(self):
         """Return True if PG&E responds with status online, False otherwise."""
-        if self.need_token():
-            self.get_token()
+        self.refresh_token()
         print(f"Requesting service status from {self.service_status_uri}")
 
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
-        response = requests.get(
-            self.service_status_uri, headers=header_params, cert=self.cert
+        response = self._session.get(
+            self.service_status_uri, headers=self._bearer_header
         )
         if not response:
             print(f"No response from {self.service_status_uri}")
             return False
-        if not str(response.status_code) == "200":
+        if response.status_code != 200:
             print(f"Error: {response.status_code}, {response.text}")
             return False
         try:
-            root = ET.fromstring(response.text)
+            root = ET.fromstring(response.content)
             if root[0].text == "1":
                 print("Service status is online.")
                 return True
@@ -371,6 +607,12 @@ class PgeRegister:
         self.access_token = None
         self.testing_completed = False
 
+    @staticmethod
+    def _print(*args):
+        """Print whole lines while requests run on several threads."""
+        with _PRINT_LOCK:
+            print(*args)
+
     def get_credentials(self):
         """Backup CLI method to retrieve credentials from user."""
         return (
@@ -386,100 +628,96 @@ class PgeRegister:
 
         self._api.token_uri = "https://api.pge.com/datacustodian/test/oauth/v2/token"
 
-        print(f"Requesting client access token from {self._api.token_uri}")
+        self._print(f"Requesting client access token from {self._api.token_uri}")
         self.access_token = self._api.get_token()
         if self.access_token:
-            print(f"Access token received: {self.access_token}")
+            self._print(f"Access token received: {self.access_token}")
             return
-        print("Request failed, see log.")
+        self._print("Request failed, see log.")
 
     def get_service_status(self):
-        print(f"Requesting service status from {self._api.service_status_uri}")
+        self._print(f"Requesting service status from {self._api.service_status_uri}")
 
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
-        response = requests.get(
-            self._api.service_status_uri, headers=header_params, cert=self._api.cert
+        response = self._api._session.get(
+            self._api.service_status_uri, headers=self._api._bearer_header
         )
         if not response:
-            print(f"No response from {self._api.service_status_uri}")
+            self._print(f"No response from {self._api.service_status_uri}")
             return False
-        if not str(response.status_code) == "200":
-            print(f"Error: {response.status_code}, {response.text}")
+        if response.status_code != 200:
+            self._print(f"Error: {response.status_code}, {response.text}")
             return False
         try:
-            root = ET.fromstring(response.text)
+            root = ET.fromstring(response.content)
             if root[0].text == "1":
-                print("Service status is online.")
+                self._print("Service status is online.")
                 return True
-            print("Service status is offline.")
+            self._print("Service status is offline.")
             return False
         except ET.ParseError:
-            print(f"Could not parse XML: {response.text}")
+            self._print(f"Could not parse XML: {response.text}")
             return False
 
     def get_sample_data(self):
         _uri = "https://api.pge.com/GreenButtonConnect/espi/1_1/resource/DownloadSampleData"
 
-        print(f"Requesting sample data from {_uri}")
+        self._print(f"Requesting sample data from {_uri}")
 
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
-        response = requests.get(_uri, headers=header_params, cert=self._api.cert)
+        response = self._api._session.get(_uri, headers=self._api._bearer_header)
         if not response:
-            print(f"No response from {_uri}")
+            self._print(f"No response from {_uri}")
             return False
-        if str(response.status_code) != "200" or str(response.status_code) != "202":
-            print(f"Error: {response.status_code}, {response.text}")
+        if response.status_code not in (200, 202):
+            self._print(f"Error: {response.status_code}, {response.text}")
             return False
-        self.testing_completed = True
         return True
         # MAYBE parse this before returning True in future... maybe
 
     def get_third_party_id(self):
-        print("Requesting Third Party ID {BulkID}.")
+        self._print("Requesting Third Party ID {BulkID}.")
 
-        header_params = {"Authorization": f"Bearer {self.access_token}"}
-        response = requests.get(
+        response = self._api._session.get(
             "https://api.pge.com/GreenButtonConnect/espi/1_1/resource/Authorization",
-            headers=header_params,
-            cert=self._api.cert,
+            headers=self._api._bearer_header,
         )
 
         if not response:
-            print("No response from server.")
-        if not str(response.status_code) == "200":
-            print(f"Error: {response.status_code}, {response.text}")
+            self._print("No response from server.")
+        if response.status_code != 200:
+            self._print(f"Error: {response.status_code}, {response.text}")
             return
 
-        def search_xml_for_id(root, tag, text, n, result):
-            for child in root:
-                if child.tag == tag:
-                    if child.text[:n] == text:
-                        result = child.text[n:]
-                        break
-                result = search_xml_for_id(child, tag, text, n, result)
-            return result
-
-        root = ET.fromstring(response.text)
         tag = "{http://naesb.org/espi}resourceURI"
         text = "https://api.pge.com/GreenButtonConnect/espi/1_1/resource/Batch/Bulk/"
-        return search_xml_for_id(root, tag, text, len(text), None)
+        for _, elem in ET.iterparse(BytesIO(response.content), events=("end",)):
+            if elem.tag == tag and elem.text and elem.text.startswith(text):
+                return elem.text[len(text) :]
+            elem.clear()
+        return None
 
     def complete_testing(self):
         self.get_token()
         if not self.access_token:
-            print("Request for access_token failed, stopping complete_testing()")
+            self._print("Request for access_token failed, stopping complete_testing()")
             return
 
         if not self.get_service_status():
-            print("Service status is not online, stopping complete_testing()")
+            self._print("Service status is not online, stopping complete_testing()")
             return
 
-        if not self.get_sample_data():
-            print("Request for sample data failed, stopping complete_testing()")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            sample_data = executor.submit(self.get_sample_data)
+            third_party_id = executor.submit(self.get_third_party_id)
+
+        if not sample_data.result():
+            self._print("Request for sample data failed, stopping complete_testing()")
             return
 
-        print("Testing completed.")
-        bulk_id = self.get_third_party_id()
+        self.testing_completed = True
+        self._print("Testing completed.")
+        bulk_id = third_party_id.result()
         if bulk_id:
-            print(f"Your Bulk ID / Bulk Resource ID / Third Party ID is {bulk_id}")
+            self._print(
+                f"Your Bulk ID / Bulk Resource ID / Third Party ID is {bulk_id}"
+            )
         return
@@ -1,24 +1,46 @@
 """Helper functinos for pgesmd."""
 
-import json
 import os
 import requests
 import logging
 import time
 from datetime import datetime
-from operator import itemgetter
+from functools import lru_cache
 from xml.etree import cElementTree as ET
-from io import StringIO
+from io import BytesIO, StringIO
+import numpy as np
+from lxml import etree as LET
+
+from ._json import loads
 
 _LOGGER = logging.getLogger(__name__)
 
+ESPI_NS = "{http://naesb.org/espi}"
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+
+
+def _espi_names(ns):
+    """Return the prefix map and the namespaced tags for an ESPI namespace."""
+    return (
+        {"espi": ns.strip("{}")},
+        f"{ns}powerOfTenMultiplier",
+        f"{ns}IntervalBlock",
+    )
+
+
+_NS, _TAG_MULTIPLIER, _TAG_INTERVAL_BLOCK = _espi_names(ESPI_NS)
+_INTERVAL_START_PATH = "espi:interval/espi:start"
+_READING_PATH = ".//espi:IntervalReading"
+_READING_START_PATH = "espi:timePeriod/espi:start"
+_READING_VALUE_PATH = "espi:value"
+
 
 def get_auth_file(auth_path=f"{os.getcwd()}/auth/auth.json"):
     """Try to open auth.json and return tuple."""
     try:
-        with open(auth_path) as auth:
+        with open(auth_path, "rb") as auth:
             data = auth.read()
-            json_data = json.loads(data)
+            json_data = loads(data)
             try:
                 third_party_id = json_data["third_party_id"]
                 client_id = json_data["client_id"]
@@ -33,8 +55,7 @@ def get_auth_file(auth_path=f"{os.getcwd()}/auth/auth.json"):
                     cert_key_path,
                 )
             except KeyError:
-                _LOGGER.error(
-                    """
+                _LOGGER.error("""
                     Auth file should be JSON:
                     {
                         "third_party_id" : string,
@@ -43,29 +64,234 @@ def get_auth_file(auth_path=f"{os.getcwd()}/auth/auth.json"):
                         "cert_crt_path" : string (full path),
                         "cert_key_path" : string (full path)
                     }
-                    """
-                )
+                    """)
             return None
     except FileNotFoundError:
         _LOGGER.error(f"Auth file not found at {auth_path}.")
         return None
 
 
-def get_bulk_id_from_xml(
-    xml, ns="{http://naesb.org/espi}", ns1="{http://www.w3.org/2005/Atom}"
-):
+def get_bulk_id_from_xml(xml, ns=ESPI_NS, ns1=ATOM_NS):
     """Get the PGE Bulk ID from the incoming xml."""
-    root = ET.fromstring(xml)
-    for child in root.iter(f"{ns1}link"):
-        link = child.attrib["href"]
-        break
+    tag_link = f"{ns1}link"
+    source = StringIO(xml) if isinstance(xml, str) else BytesIO(xml)
+    for _, elem in ET.iterparse(source, events=("start",)):
+        if elem.tag == tag_link:
+            link = elem.attrib["href"]
+            break
     for i in range(len(link) - 1, 0, -1):
         if link[i] == "/":
             break
-    return int(link[i + 1:])
+    return int(link[i + 1 :])
+
+
+@lru_cache(maxsize=None)
+def _espi_selectors(ns):
+    """Return the tags and compiled XPath selectors used by _iter_espi_blocks."""
+    namespaces, tag_multiplier, tag_interval_block = _espi_names(ns)
+    return (
+        tag_multiplier,
+        tag_interval_block,
+        LET.XPath(
+            "espi:IntervalReading/espi:timePeriod/espi:start/text()",
+            namespaces=namespaces,
+        ),
+        LET.XPath(
+            "espi:IntervalReading/espi:timePeriod/espi:duration/text()",
+            namespaces=namespaces,
+        ),
+        LET.XPath("espi:IntervalReading/espi:value/text()", namespaces=namespaces),
+    )
+
+
+def _iter_espi_blocks(xml, ns):
+    """Yield a (4, n) int64 array for each IntervalBlock of n readings.
+
+    The rows are start, duration, value and powerOfTenMultiplier.
+    """
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+
+    (
+        tag_multiplier,
+        tag_interval_block,
+        select_starts,
+        select_durations,
+        select_values,
+    ) = _espi_selectors(ns)
+
+    context = LET.iterparse(BytesIO(xml), tag=(tag_multiplier, tag_interval_block))
+    for _, data in context:
+        if data.tag == tag_multiplier:
+            mp = int(data.text)
+            continue
+
+        starts = select_starts(data)
+        durations = select_durations(data)
+        values = select_values(data)
+        if not len(starts) == len(durations) == len(values):
+            raise ValueError("IntervalBlock contains an incomplete IntervalReading.")
+
+        block = np.empty((4, len(starts)), dtype=np.int64)
+        block[:3] = np.array((starts, durations, values)).astype(np.int64)
+        block[3] = mp
+        yield block
+
+        # Drop the finished block and everything parsed before it
+        data.clear()
+        elem = data
+        while elem.getparent() is not None:
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+            elem = elem.getparent()
+
+
+def _repair_dst_arrays(starts, durations, watt_hours):
+    """Repair Daylight Savings Time transitions with NumPy array operations."""
+    # Clocks forward: a reading follows a gap.  If the next reading repeats it
+    # (the clocks back pattern) it is relabelled into the gap, otherwise a
+    # reading is inserted.  Either way the gap gets the average of the
+    # readings on both sides.  Repeated readings are left for the next step.
+    later = starts[1:]
+    gap = (later != starts[:-1] + durations[1:]) & (later != starts[:-1])
+    forward = np.flatnonzero(gap) + 1
+    repeated_next = np.zeros(len(starts), dtype=bool)
+    repeated_next[:-1] = starts[1:] == starts[:-1]
+
+    gap_starts = starts[forward - 1] + durations[forward]
+    gap_durations = durations[forward]
+    averaged = (watt_hours[forward - 1] + watt_hours[forward]) / 2
+    gap_watt_hours = averaged.astype(np.int64)
+
+    relabel = repeated_next[forward]
+    starts[forward[relabel]] = gap_starts[relabel]
+    watt_hours[forward[relabel]] = gap_watt_hours[relabel]
+
+    insert = ~relabel
+    if insert.any():
+        positions = forward[insert]
+        starts = np.insert(starts, positions, gap_starts[insert])
+        durations = np.insert(durations, positions, gap_durations[insert])
+        watt_hours = np.insert(watt_hours, positions, gap_watt_hours[insert])
+
+    # Clocks back: drop readings that repeat the previous start
+    repeated = np.flatnonzero(starts[1:] == starts[:-1]) + 1
+    if len(repeated):
+        starts = np.delete(starts, repeated)
+        durations = np.delete(durations, repeated)
+        watt_hours = np.delete(watt_hours, repeated)
+
+    return (starts, durations, watt_hours)
+
+
+def _repair_dst_loop(starts, durations, watt_hours):
+    """Repair Daylight Savings Time transitions one reading at a time.
+
+    Same result as _repair_dst_arrays.  Only fast when compiled with numba.
+    """
+    n = len(starts)
+    # A reading may be inserted into each gap, so the result is at most 2n
+    repaired_starts = np.empty(2 * n, dtype=np.int64)
+    repaired_durations = np.empty(2 * n, dtype=np.int64)
+    repaired_watt_hours = np.empty(2 * n, dtype=np.int64)
+    if n == 0:
+        return (repaired_starts, repaired_durations, repaired_watt_hours)
+
+    repaired_starts[0] = starts[0]
+    repaired_durations[0] = durations[0]
+    repaired_watt_hours[0] = watt_hours[0]
+    kept = 1
+    for i in range(1, n):
+        start = starts[i]
+        duration = durations[i]
+        value = watt_hours[i]
+        previous_start = starts[i - 1]
+
+        if start != previous_start + duration and start != previous_start:
+            # clocks forward
+            gap_start = previous_start + duration
+            gap_watt_hours = int((watt_hours[i - 1] + value) / 2)
+            if i + 1 < n and starts[i + 1] == start:
+                start = gap_start
+                value = gap_watt_hours
+            else:
+                repaired_starts[kept] = gap_start
+                repaired_durations[kept] = duration
+                repaired_watt_hours[kept] = gap_watt_hours
+                kept += 1
+
+        if start == repaired_starts[kept - 1]:  # clocks back
+            continue
+
+        repaired_starts[kept] = start
+        repaired_durations[kept] = duration
+        repaired_watt_hours[kept] = value
+        kept += 1
+
+    return (
+        repaired_starts[:kept],
+        repaired_durations[:kept],
+        repaired_watt_hours[:kept],
+    )
+
+
+@lru_cache(maxsize=None)
+def _compile_repair_dst_loop():
+    """Return _repair_dst_loop compiled by numba, or None if not installed.
+
+    numba is imported on first use because importing it is slow.
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    return njit(_repair_dst_loop)
+
+
+def _repair_dst(starts, durations, watt_hours):
+    """Repair Daylight Savings Time transitions.
+
+    The NumPy repair is used unless the PGESMD_JIT environment variable is set
+    and numba is installed.  Compiling costs more than it saves on a single
+    parse, so the numba loop is opt in.
+    """
+    if os.environ.get("PGESMD_JIT"):
+        repair_dst_loop = _compile_repair_dst_loop()
+        if repair_dst_loop is not None:
+            return repair_dst_loop(starts, durations, watt_hours)
+
+    return _repair_dst_arrays(starts, durations, watt_hours)
+
+
+def parse_espi_data_arrays(xml, ns=ESPI_NS):
+    """Return the ESPI Interval Readings as NumPy arrays.
+
+    Returns a tuple of int64 arrays of equal length:
+        (starts, durations, watthours)
 
+    Daylight Savings Time transitions are handled as in parse_espi_data.
+    """
+    _LOGGER.debug("Parsing the XML.")
+
+    blocks = list(_iter_espi_blocks(xml, ns))
+    if blocks:
+        starts, durations, values, multipliers = np.concatenate(blocks, axis=1)
+    else:
+        starts, durations, values, multipliers = np.empty((4, 0), dtype=np.int64)
+
+    # watthours = value * 10**powerOfTenMultiplier * duration / 3600 in integer
+    # arithmetic, rounding half to even like round()
+    numerator = values * durations * np.power(10, np.maximum(multipliers, 0))
+    denominator = 3600 * np.power(10, np.maximum(-multipliers, 0))
+    watt_hours, remainder = np.divmod(numerator, denominator)
+    twice = 2 * remainder
+    round_up = (twice > denominator) | ((twice == denominator) & (watt_hours % 2 == 1))
+    watt_hours += round_up
+
+    return _repair_dst(starts, durations, watt_hours)
 
-def parse_espi_data(xml, ns="{http://naesb.org/espi}"):
+
+def parse_espi_data(xml, ns=ESPI_NS):
     """Generate ESPI tuple from ESPI XML.
 
     Sequentially yields a tuple for each Interval Reading:
@@ -79,83 +305,66 @@ def parse_espi_data(xml, ns="{http://naesb.org/espi}"):
         missing hour is filled with the average of the previous and following
         values in order to maintain 24 hours per day.
     """
-    _LOGGER.debug("Parsing the XML.")
-
-    # Find initial values
-    root = ET.fromstring(xml)
-    for child in root.iter(f"{ns}timePeriod"):
-        first_start = int(child.find(f"{ns}start").text)
-        duration = int(child.find(f"{ns}duration").text)
-        break
-    previous = (first_start - duration, 0, 0)
-    root.clear()
-
-    xml = StringIO(xml)
-
-    # Find all values
-    it = map(itemgetter(1), iter(ET.iterparse(xml)))
-    for data in it:
-        if data.tag == f"{ns}powerOfTenMultiplier":
-            mp = int(data.text)
-        if data.tag == f"{ns}IntervalBlock":
-            for interval in data.findall(f"{ns}IntervalReading"):
-                time_period = interval.find(f"{ns}timePeriod")
-
-                duration = int(time_period.find(f"{ns}duration").text)
-                start = int(time_period.find(f"{ns}start").text)
-                value = int(interval.find(f"{ns}value").text)
-                watt_hours = int(round(value * pow(10, mp) * duration / 3600))
-
-                if start == previous[0]:  # clocks back
-                    continue
-
-                if not start == previous[0] + duration:  # clocks forward
-                    start = previous[0] + duration
-                    watt_hours = int((previous[2] + watt_hours) / 2)
-                    previous = (start, duration, watt_hours)
-                    yield (start, duration, watt_hours)
-                    continue
-
-                previous = (start, duration, watt_hours)
-                yield (start, duration, watt_hours)
-
-            data.clear()
+    starts, durations, watt_hours = parse_espi_data_arrays(xml, ns)
+    yield from zip(starts.tolist(), durations.tolist(), watt_hours.tolist())
 
 
 def save_espi_xml(self, xml_data, filename=None):
-    """Save ESPI XML to a file named by timestamp or filename key."""
+    """Save ESPI XML bytes to a file named by timestamp or filename key."""
     if filename:
         save_name = f"{os.getcwd()}/data/espi_xml/{filename}.xml"
     else:
         timestamp = time.strftime("%y.%m.%d %H:%M:%S", time.localtime())
         save_name = f"{os.getcwd()}/data/espi_xml/{timestamp}.xml"
 
-    with open(save_name, "w") as file:
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode("utf-8")
+
+    with open(save_name, "wb") as file:
         file.write(xml_data)
     return save_name
 
 
 def get_emoncms_from_espi(xml_data, emoncms_node=30):
     """Parse ESPI data for export to emonCMS."""
-    root = ET.fromstring(xml_data)
-    ns = {"espi": "http://naesb.org/espi"}
-
-    emoncms_data = []
-
-    multiplier = pow(10, int(root.find(".//espi:powerOfTenMultiplier", ns).text))
-
-    date_start = int(root.find(".//espi:interval", ns).find(".//espi:start", ns).text)
-
-    interval_block = root.find(".//espi:IntervalBlock", ns)
-    for reading in interval_block.findall(".//espi:IntervalReading", ns):
-        start = int(reading.find(".//espi:start", ns).text)
-        value = int(reading.find(".//espi:value", ns).text)
-        watt_hours = int(value * multiplier)
-        offset = start - date_start
-
-        emoncms_data.append([offset, emoncms_node, watt_hours])
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode("utf-8")
+
+    # Stream only as far as the multiplier and the first IntervalBlock
+    multiplier = interval_block = None
+    context = LET.iterparse(
+        BytesIO(xml_data), tag=(_TAG_MULTIPLIER, _TAG_INTERVAL_BLOCK)
+    )
+    for _, elem in context:
+        if elem.tag == _TAG_MULTIPLIER:
+            if multiplier is None:
+                multiplier = pow(10, int(elem.text))
+        elif interval_block is None:
+            interval_block = elem
+        if multiplier is not None and interval_block is not None:
+            break
 
-    return (date_start, emoncms_data)
+    date_start = int(interval_block.find(_INTERVAL_START_PATH, _NS).text)
+
+    readings = interval_block.findall(_READING_PATH, _NS)
+    starts = np.fromiter(
+        (int(reading.find(_READING_START_PATH, _NS).text) for reading in readings),
+        dtype=np.int64,
+        count=len(readings),
+    )
+    values = np.fromiter(
+        (int(reading.find(_READING_VALUE_PATH, _NS).text) for reading in readings),
+        dtype=np.int64,
+        count=len(readings),
+    )
+
+    # Rows of [offset, node, watt_hours], converted to lists in one call
+    emoncms_data = np.empty((len(readings), 3), dtype=np.int64)
+    emoncms_data[:, 0] = starts - date_start
+    emoncms_data[:, 1] = emoncms_node
+    emoncms_data[:, 2] = (values * multiplier).astype(np.int64)
+
+    return (date_start, emoncms_data.tolist())
 
 
 def post_data_to_emoncms(for_emoncms, emoncms_ip, emoncms_write_key):
@@ -1,13 +1,18 @@
 """Test the SelfAccessApi."""
 
+import asyncio
 import unittest
 import os
 import threading
 import json
 import time
+import tempfile
+import warnings
+import httpx
+from unittest import mock
 
 from .server import HTTPServer, BaseHTTPRequestHandler
-from .api import SelfAccessApi
+from .api import SelfAccessApi, PgeRegister
 
 PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 print(f"Testing in: {PROJECT_PATH}")
@@ -35,6 +40,7 @@ class TestSelfAccessApi(unittest.TestCase):
             f"{PROJECT_PATH}/tests/cert/cert.crt",
             f"{PROJECT_PATH}/tests/cert/private.key",
             token_uri="http://localhost:8999/token",
+            token_cache_path=None,
         )
 
     def test_checkRI(self):
@@ -51,6 +57,14 @@ class TestSelfAccessApi(unittest.TestCase):
 
         self.assertTrue(checkRI(self.api))
 
+    def test_get_date_range(self):
+        self.assertEqual(
+            SelfAccessApi.get_date_range("2019-10-16"), (1571209200, 1571292000)
+        )
+        self.assertEqual(
+            SelfAccessApi.get_date_range("2019-12-25"), (1577260800, 1577343600)
+        )
+
     def test_token(self):
         self.assertTrue(checkRI(self.api))
 
@@ -66,6 +80,199 @@ class TestSelfAccessApi(unittest.TestCase):
 
         self.assertTrue(checkRI(self.api))
 
+    def test_token_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.api.token_cache_path = f"{tmp}/token_cache.json"
+            self.api.access_token = "cached-token"
+            self.api.access_token_exp = time.time() + 3600
+            self.api.save_token_cache()
+            mode = os.stat(f"{tmp}/token_cache.json").st_mode & 0o777
+            self.assertEqual(mode, 0o600)
+
+            api = SelfAccessApi(
+                "55555",
+                "client_id",
+                "client_secret",
+                f"{PROJECT_PATH}/tests/cert/cert.crt",
+                f"{PROJECT_PATH}/tests/cert/private.key",
+                token_uri="http://localhost:8999/token",
+                token_cache_path=f"{tmp}/token_cache.json",
+            )
+            self.assertEqual(api.access_token, "cached-token")
+            self.assertFalse(api.need_token())
+
+            api = SelfAccessApi(
+                "55555",
+                "other_client_id",
+                "client_secret",
+                f"{PROJECT_PATH}/tests/cert/cert.crt",
+                f"{PROJECT_PATH}/tests/cert/private.key",
+                token_uri="http://localhost:8999/token",
+                token_cache_path=f"{tmp}/token_cache.json",
+            )
+            self.assertIsNone(api.access_token)
+            self.assertTrue(api.need_token())
+
+    def test_async_client_per_loop(self):
+        async def client():
+            return self.api._async_client()
+
+        first = asyncio.run(client())
+        with self.assertLogs("pgesmd_self_access.api", "WARNING"):
+            second = asyncio.run(client())
+        self.assertIsNot(first, second)
+        # first never opened a connection, so it can close on any loop
+        asyncio.run(first.aclose())
+        asyncio.run(second.aclose())
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        third = loop.run_until_complete(client())
+        self.assertIsNot(second, third)
+        self.api.close()
+        self.assertTrue(third.is_closed)
+        self.assertIsNone(self.api._aclient)
+
+    def test_close_in_running_loop(self):
+        async def close():
+            aclient = self.api._async_client()
+            self.api.close()
+            await asyncio.sleep(0.01)
+            return aclient
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            aclient = asyncio.run(close())
+        self.assertTrue(aclient.is_closed)
+        self.assertIsNone(self.api._aclient)
+
+    def test_arefresh_token(self):
+        threads = []
+
+        async def refresh():
+            await self.api.arefresh_token()
+            return threading.get_ident()
+
+        with mock.patch.object(
+            SelfAccessApi,
+            "get_token",
+            lambda api: threads.append(threading.get_ident()),
+        ):
+            loop_thread = asyncio.run(refresh())
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+    def test_get_espi_data_retry(self):
+        responses = [
+            FakeResponse(403, b"Forbidden"),
+            FakeResponse(200, b"<feed/>"),
+        ]
+        self.api._session = mock.Mock()
+        self.api._session.get.side_effect = lambda *args, **kwargs: responses.pop(0)
+
+        with mock.patch.object(SelfAccessApi, "get_token", return_value="the-token"):
+            self.assertEqual(self.api.get_espi_data("/resource"), b"<feed/>")
+        self.assertEqual(self.api._session.get.call_count, 2)
+
+    def test_get_espi_data_retry_once(self):
+        self.api._session = mock.Mock()
+        self.api._session.get.return_value = FakeResponse(403, b"Forbidden")
+
+        with mock.patch.object(SelfAccessApi, "get_token", return_value="the-token"):
+            self.assertIsNone(self.api.get_espi_data("/resource"))
+        self.assertEqual(self.api._session.get.call_count, 2)
+
+    def mock_client(self, handler):
+        """Patch _async_client to serve requests from handler."""
+        requests = []
+
+        def record(request):
+            requests.append(request)
+            return handler(request)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+        patcher = mock.patch.object(SelfAccessApi, "_async_client", lambda api: client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api.access_token = "the-token"
+        self.api.access_token_exp = time.time() + 3600
+        return requests
+
+    def test_arequest_date_data_rate_limited(self):
+        statuses = [429, 202]
+        requests = self.mock_client(lambda request: httpx.Response(statuses.pop(0)))
+
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            self.assertTrue(asyncio.run(self.api.arequest_date_data("2019-10-16")))
+        self.assertEqual(len(requests), 2)
+        sleep.assert_awaited_once_with(0.5)
+
+    def test_arequest_date_data_retries_exhausted(self):
+        requests = self.mock_client(lambda request: httpx.Response(429))
+
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            result = asyncio.run(self.api.arequest_date_data("2019-10-16", retries=3))
+        self.assertFalse(result)
+        self.assertEqual(len(requests), 4)
+        self.assertEqual(sleep.await_count, 3)
+
+    def test_request_date_range(self):
+        failed_start, _ = SelfAccessApi.get_date_range("2019-10-17")
+
+        def handler(request):
+            if request.url.params["published-min"] == str(failed_start):
+                return httpx.Response(500)
+            return httpx.Response(202)
+
+        requests = self.mock_client(handler)
+        dates = ["2019-10-16", "2019-10-17", "2019-10-18", "2019-10-19"]
+
+        results = self.api.request_date_range(dates, max_concurrent=2)
+        self.assertEqual(results, [True, False, True, True])
+        self.assertEqual(len(requests), 4)
+
+
+class FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode("utf-8")
+
+
+class TestPgeRegister(unittest.TestCase):
+    def setUp(self):
+        self.register = PgeRegister(
+            method=lambda path: (
+                "55555",
+                "client_id",
+                "client_secret",
+                f"{PROJECT_PATH}/tests/cert/cert.crt",
+                f"{PROJECT_PATH}/tests/cert/private.key",
+            )
+        )
+        self.register._print = lambda *args: None
+        self.register.get_token = lambda: setattr(
+            self.register, "access_token", "the-token"
+        )
+        self.register.get_sample_data = lambda: True
+        self.register.get_third_party_id = lambda: "55555"
+
+    def test_complete_testing(self):
+        self.register.get_service_status = lambda: True
+        self.register.complete_testing()
+        self.assertTrue(self.register.testing_completed)
+
+    def test_complete_testing_offline(self):
+        self.register.get_service_status = lambda: False
+        self.register.complete_testing()
+        self.assertFalse(self.register.testing_completed)
+
+    def test_complete_testing_sample_data_failed(self):
+        self.register.get_service_status = lambda: True
+        self.register.get_sample_data = lambda: False
+        self.register.complete_testing()
+        self.assertFalse(self.register.testing_completed)
+
 
 class FakeServer(BaseHTTPRequestHandler):
     def do_POST(self):
@@ -4,10 +4,23 @@ import unittest
 import os
 import time
 import json
+from pathlib import Path
 
-from .helpers import get_auth_file, get_bulk_id_from_xml, parse_espi_data
+import numpy as np
+
+from .helpers import (
+    _compile_repair_dst_loop,
+    _repair_dst_arrays,
+    _repair_dst_loop,
+    get_auth_file,
+    get_bulk_id_from_xml,
+    get_emoncms_from_espi,
+    parse_espi_data,
+    parse_espi_data_arrays,
+)
 
 PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ESPI_PATH = Path(PROJECT_PATH) / "tests" / "data" / "espi"
 
 answers = [
     (1570086000, 3600, 1067),
@@ -40,6 +53,11 @@ answers = [
 class TestHelpers(unittest.TestCase):
     """Test pgesmd.helpers."""
 
+    @classmethod
+    def setUpClass(cls):
+        cls.xml_1day = (ESPI_PATH / "espi_1_day.xml").read_bytes()
+        cls.xml_2yr = (ESPI_PATH / "espi_2_years.xml").read_bytes()
+
     def test_get_auth_file(self):
         """Test get_auth_file()."""
         self.assertEqual(get_auth_file("bad_path"), None)
@@ -57,26 +75,22 @@ class TestHelpers(unittest.TestCase):
 
     def test_get_bulk_id(self):
         """Test the Bulk ID parse."""
-        xml_fp = open(f"{PROJECT_PATH}/tests/data/espi/espi_1_day.xml", "r")
-        xml = xml_fp.read()
-        xml_fp.close()
-
-        self.assertEqual(get_bulk_id_from_xml(xml), 50916)
+        self.assertEqual(get_bulk_id_from_xml(self.xml_1day), 50916)
+        self.assertEqual(get_bulk_id_from_xml(self.xml_1day.decode("utf-8")), 50916)
 
     def test_parse_espi(self):
         """Test parse_espi_data()."""
-        xml_fp = open(f"{PROJECT_PATH}/tests/data/espi/espi_1_day.xml", "r")
-        xml = xml_fp.read()
-        for entry, answer in zip(parse_espi_data(xml), answers):
-            self.assertEqual(entry, answer)
-        xml_fp.close()
-
-        xml_fp = open(f"{PROJECT_PATH}/tests/data/espi/espi_2_years.xml", "r")
-        xml = xml_fp.read()
-        dump = []
-        for entry in parse_espi_data(xml):
-            dump.append(entry)
-        xml_fp.close()
+        self.assertEqual(list(parse_espi_data(self.xml_1day)), answers)
+        self.assertEqual(list(parse_espi_data(self.xml_1day.decode("utf-8"))), answers)
+
+        #  a stylesheet instruction and a comment before the root element
+        prolog = (
+            b'<?xml-stylesheet type="text/xsl" href="GreenButtonDataStyleSheet.xslt"?>'
+            b"<!-- Green Button -->"
+        )
+        self.assertEqual(list(parse_espi_data(prolog + self.xml_1day)), answers)
+
+        dump = list(parse_espi_data(self.xml_2yr))
         #  17,496 hours / 24 = 729 days of data
         self.assertEqual(len(dump), 17496)
 
@@ -84,6 +98,72 @@ class TestHelpers(unittest.TestCase):
         self.assertEqual(dump[0], (1508396400, 3600, 447))
         self.assertEqual(dump[17495], (1571378400, 3600, 1643))
 
+    def test_parse_espi_arrays(self):
+        """Test parse_espi_data_arrays()."""
+        xml = self.xml_1day
+
+        starts, durations, watt_hours = parse_espi_data_arrays(xml)
+        self.assertEqual(list(zip(starts, durations, watt_hours)), answers)
+
+        #  clocks set back: the first reading is repeated
+        start = xml.index(b"<ns0:IntervalReading>")
+        end = xml.index(b"</ns0:IntervalReading>") + len(b"</ns0:IntervalReading>")
+        repeated = xml[:end] + xml[start:end] + xml[end:]
+        starts, durations, watt_hours = parse_espi_data_arrays(repeated)
+        self.assertEqual(list(zip(starts, durations, watt_hours)), answers)
+
+        #  clocks set forward: the 11th hour is missing and the 12th repeated
+        skipped = xml.replace(b"1570122000", b"1570125600")
+        starts, durations, watt_hours = parse_espi_data_arrays(skipped)
+        self.assertEqual(starts.tolist(), [entry[0] for entry in answers])
+        self.assertEqual(watt_hours[10], (854 + 1230) // 2)
+        self.assertEqual(watt_hours[11], 871)
+
+    def test_repair_dst(self):
+        """Test the NumPy, loop and compiled loop DST repairs agree."""
+        functions = [_repair_dst_arrays, _repair_dst_loop]
+        if _compile_repair_dst_loop() is not None:
+            functions.append(_compile_repair_dst_loop())
+
+        starts = [0, 3600, 3600, 7200, 14400, 14400, 18000, 25200, 28800]
+        watt_hours = [10, 20, 30, 40, 50, 60, 70, 80, 90]
+
+        def repair(starts, watt_hours, function):
+            result = function(
+                np.array(starts, dtype=np.int64),
+                np.full(len(starts), 3600, dtype=np.int64),
+                np.array(watt_hours, dtype=np.int64),
+            )
+            return [array.tolist() for array in result]
+
+        expected = [
+            [0, 3600, 7200, 10800, 14400, 18000, 21600, 25200, 28800],
+            [3600] * 9,
+            [10, 20, 40, 45, 60, 70, 75, 80, 90],
+        ]
+        for function in functions:
+            self.assertEqual(repair(starts, watt_hours, function), expected)
+
+        #  a missing hour is filled without moving the following reading
+        expected = [
+            [0, 3600, 7200, 10800, 14400, 18000],
+            [3600] * 6,
+            [10, 20, 30, 40, 50, 60],
+        ]
+        for function in functions:
+            self.assertEqual(
+                repair([0, 3600, 10800, 14400, 18000], [10, 20, 40, 50, 60], function),
+                expected,
+            )
+
+    def test_get_emoncms_from_espi(self):
+        """Test get_emoncms_from_espi()."""
+        date_start, emoncms_data = get_emoncms_from_espi(self.xml_1day)
+        self.assertEqual(date_start, 1570086000)
+        self.assertEqual(len(emoncms_data), 24)
+        self.assertEqual(emoncms_data[0], [0, 30, 1067])
+        self.assertEqual(emoncms_data[23], [82800, 30, 4148])
+
 
 if __name__ == "__main__":
     unittest.main()
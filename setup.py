@@ -18,6 +18,16 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    install_requires=["pytz", "requests"],
+    install_requires=[
+        "httpx[http2]",
+        "lxml",
+        "numpy",
+        "orjson>=3.10",
+        "requests",
+        "urllib3>=1.26",
+        "backports.zoneinfo; python_version < '3.9'",
+        "tzdata",
+    ],
+    extras_require={"jit": ["numba"]},
     python_requires=">=3.8",
 )